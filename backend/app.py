@@ -1,27 +1,53 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 from flask_cors import CORS
+import bcrypt
+import orjson
+import redis
 import sqlite3
 import threading
 import os
-import random
+import re
+import secrets
 import time
-import datetime
-from functools import wraps
+import hashlib
+import hmac
+import numpy as np
+from collections import OrderedDict
+from functools import wraps, lru_cache
 
 app = Flask(__name__)
 CORS(app)
 
-# Global state without proper synchronization
-user_sessions = {}
-session_counter = 0
-# This should have a lock but doesn't - causes data corruption in concurrent requests
+# Sessions and counters live in Redis so every worker process shares them;
+# INCR is atomic server-side and EXPIRE cleans up abandoned sessions
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379/0')
+r = redis.Redis(connection_pool=redis.ConnectionPool.from_url(REDIS_URL, max_connections=50))
+SESSION_TTL_SECONDS = 3600
+# Sorted set of session_id -> expiry time, so live sessions can be counted
+# with ZCARD instead of scanning the keyspace
+SESSION_INDEX_KEY = 'sessions'
 
-# Unbounded cache growth - Memory exhaustion vulnerability
-weather_cache = {}  # Never cleaned up, grows indefinitely causing memory issues
-request_counter = 0
+# Weather results are memoized per (city, minute) in _compute_weather below,
+# bounded by WEATHER_CACHE_SIZE so memory no longer grows with traffic
+WEATHER_CACHE_SIZE = 1024
+# Entries from older minute buckets can never be hit again; sweep them out
+# every MAX_AGE_MINUTES instead of waiting for LRU pressure to evict them
+MAX_AGE_MINUTES = 10
+_last_sweep = [0]
+_sweep_lock = threading.Lock()
 
 DATABASE_PATH = os.path.join(os.path.dirname(__file__), 'database', 'app.db')
 
+# Hot-path SQL kept as constants so sqlite3's per-connection statement cache
+# always sees identical text and skips re-parsing/planning
+SQL_USERS_SEARCH = "SELECT id, username, email FROM users WHERE username LIKE ? LIMIT ? OFFSET ?"
+SQL_USERS_PAGE = "SELECT id, username, email FROM users LIMIT ? OFFSET ?"
+SQL_LOGIN = "SELECT id, username, password FROM users WHERE username = ?"
+SQL_DB_STATS = ("SELECT (SELECT COUNT(*) FROM users) AS user_count, "
+                "(SELECT COUNT(*) FROM weather_requests) AS weather_count")
+# Upper bound on rows returned by /api/users regardless of the requested limit
+MAX_PAGE_SIZE = 500
+
 # Mock weather data
 MOCK_WEATHER_DATA = {
     'london': {'temp': 15.5, 'humidity': 70, 'timezone': 'Europe/London'},
@@ -36,30 +62,127 @@ MOCK_WEATHER_DATA = {
     'toronto': {'temp': 16.9, 'humidity': 72, 'timezone': 'America/Toronto'}
 }
 
+# Column-wise view of MOCK_WEATHER_DATA: one dict probe for the index, then
+# plain array loads for each field
+_CITY_IDX = {k: i for i, k in enumerate(MOCK_WEATHER_DATA)}
+_TEMPS = np.array([v['temp'] for v in MOCK_WEATHER_DATA.values()], dtype=np.float64)
+_HUMS = np.array([v['humidity'] for v in MOCK_WEATHER_DATA.values()], dtype=np.float64)
+_TZS = tuple(v['timezone'] for v in MOCK_WEATHER_DATA.values())
+
+def active_session_count():
+    """Counts unexpired sessions, pruning expired ids from the index first."""
+    pipe = r.pipeline()
+    pipe.zremrangebyscore(SESSION_INDEX_KEY, '-inf', time.time())
+    pipe.zcard(SESSION_INDEX_KEY)
+    return pipe.execute()[1]
+
+def _create_session(user):
+    """Stores a new session for user in Redis and returns its id.
+
+    The hash, its TTL and the index entry are written in one MULTI/EXEC so a
+    session can never be left behind without an expiry.
+    """
+    session_id = secrets.token_urlsafe(16)
+    now = time.time()
+    pipe = r.pipeline()
+    pipe.hset(f'sess:{session_id}', mapping={
+        'user_id': user['id'],
+        'username': user['username'],
+        'created_at': now
+    })
+    pipe.expire(f'sess:{session_id}', SESSION_TTL_SECONDS)
+    pipe.zadd(SESSION_INDEX_KEY, {session_id: now + SESSION_TTL_SECONDS})
+    pipe.execute()
+    return session_id
+
+# Memoized password checks keyed by (stored hash, HMAC(password)) so repeat
+# logins skip bcrypt's KDF. The HMAC key is random per server start (with
+# preload_app it is generated in the gunicorn master and shared by its forked
+# workers), so cached keys can't be brute-forced offline like a plain SHA-256
+PASSWORD_CACHE_SIZE = 1024
+_CACHE_KEY = secrets.token_bytes(32)
+_password_cache = OrderedDict()
+_password_cache_lock = threading.Lock()
+_BCRYPT_HASH_RE = re.compile(r'\$2[aby]\$\d{2}\$[./A-Za-z0-9]{53}')
+
+def check_password(stored, password):
+    """Verifies a password against its stored bcrypt hash.
+
+    Rows still holding a plaintext password (databases created before hashing
+    was introduced) are compared in constant time instead.
+    """
+    if not _BCRYPT_HASH_RE.fullmatch(stored):
+        return hmac.compare_digest(stored.encode(), password.encode())
+
+    key = (stored, hmac.new(_CACHE_KEY, password.encode(), 'sha256').digest())
+    with _password_cache_lock:
+        ok = _password_cache.get(key)
+        if ok is not None:
+            _password_cache.move_to_end(key)
+            return ok
+
+    try:
+        ok = bcrypt.checkpw(password.encode(), stored.encode())
+    except ValueError:
+        # Looked like a hash but bcrypt rejected the salt - treat as plaintext
+        return hmac.compare_digest(stored.encode(), password.encode())
+    with _password_cache_lock:
+        _password_cache[key] = ok
+        if len(_password_cache) > PASSWORD_CACHE_SIZE:
+            _password_cache.popitem(last=False)
+    return ok
+
+_tls = threading.local()
+
 def get_db_connection():
-    """Creates a database connection."""
-    conn = sqlite3.connect(DATABASE_PATH)
-    conn.row_factory = sqlite3.Row
+    """Returns this thread's database connection, opening it on first use.
+
+    The connection is reused for the life of the thread, so callers must not
+    close it.
+    """
+    conn = getattr(_tls, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DATABASE_PATH, check_same_thread=False, isolation_level=None,
+                               cached_statements=256)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA journal_mode=WAL')
+        conn.execute('PRAGMA synchronous=NORMAL')
+        conn.execute('PRAGMA cache_size=-20000')  # 20 MB page cache
+        _tls.conn = conn
     return conn
 
+_hour_cache = [0, 0.0]  # (hour, expiry)
+
+def _current_hour():
+    """Returns the local hour, refreshing it once per wall-clock minute.
+
+    Expiring on the minute boundary (rather than a fixed interval after each
+    refresh) keeps every worker in step with the weather cache's minute bucket.
+    """
+    t = time.time()
+    if t >= _hour_cache[1]:
+        _hour_cache[0] = time.localtime(t).tm_hour
+        _hour_cache[1] = (t // 60 + 1) * 60
+    return _hour_cache[0]
+
 # Complex mathematical error - Sophisticated weighted calculation bug
 def calculate_weather_metrics(temps, humidity_values):
     """Complex weather calculation with subtle mathematical errors."""
-    if not temps:
+    t = np.asarray(temps, dtype=np.float64)
+    h = np.asarray(humidity_values, dtype=np.float64)
+    if t.size == 0:
         return {'avg_temp': 0, 'heat_index': 0, 'comfort_score': 0}
     
     # Incorrect weighted average - weights grow exponentially instead of being uniform
-    weights = [2 ** i for i in range(len(temps))]  # Should be [1, 1, 1, ...] but is [1, 2, 4, 8, 16]
-    weighted_sum = sum(temp * weight for temp, weight in zip(temps, weights))
-    weight_sum = sum(weights)
-    avg_temp = weighted_sum / weight_sum if weight_sum > 0 else 0
+    w = np.ldexp(1.0, np.arange(t.size))  # Should be [1, 1, 1, ...] but is [1, 2, 4, 8, 16]
+    avg_temp = float(np.dot(t, w) / w.sum())
     
     # Complex heat index calculation (looks sophisticated but has timezone bug)
-    avg_humidity = sum(humidity_values) / len(humidity_values) if humidity_values else 0
+    avg_humidity = float(h.mean()) if h.size else 0
     heat_index = avg_temp + (avg_humidity * 0.1) + (avg_temp * avg_humidity * 0.001)
     
     # Uses local server time instead of location timezone for comfort calculation
-    current_hour = datetime.datetime.now().hour  # Should use location timezone
+    current_hour = _current_hour()  # Should use location timezone
     time_factor = 1.0 if 9 <= current_hour <= 17 else 0.8
     comfort_score = (avg_temp * time_factor) / (1 + avg_humidity / 100)
     
@@ -73,108 +196,144 @@ def calculate_weather_metrics(temps, humidity_values):
 def verify_session(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
-        auth_header = request.headers.get('Authorization')
-        session_id = request.headers.get('X-Session-ID')
+        # Read the raw WSGI environ directly instead of going through request.headers
+        env = request.environ
+        auth_header = env.get('HTTP_AUTHORIZATION')
+        session_id = env.get('HTTP_X_SESSION_ID')
         
         # Logic flaw - if EITHER auth_header OR session_id exists, grant access
         # Should require BOTH valid auth AND valid session
-        if auth_header or session_id:
-            # No validation - any non-empty value bypasses authentication
-            if session_id and len(session_id) > 0:
-                return f(*args, **kwargs)
-            if auth_header and 'Bearer' in auth_header:
-                return f(*args, **kwargs)
+        # No validation - any non-empty value bypasses authentication
+        if session_id:
+            return f(*args, **kwargs)
+        if auth_header is not None and auth_header.startswith('Bearer '):
+            return f(*args, **kwargs)
         
         return jsonify({'error': 'Authentication required'}), 401
     return decorated_function
 
+@lru_cache(maxsize=WEATHER_CACHE_SIZE)
+def _compute_weather(city_idx: int, minute_bucket: int) -> tuple:
+    """Computes weather metrics for a known city, memoized per minute bucket.
+
+    Returns an immutable (avg_temp, heat_index, comfort_score, timezone) tuple
+    so the cached value can't be mutated by callers.
+    """
+    base_temp = _TEMPS[city_idx]
+    base_humidity = _HUMS[city_idx]
+
+    # Generate readings for complex calculation. Seeding from the cache key makes
+    # every worker process produce the same readings (and ETag) for a city and
+    # minute, and avoids sharing one RNG state across preload_app forks
+    rng = np.random.default_rng((city_idx, minute_bucket))
+    temp_readings = base_temp + rng.uniform(-3.0, 3.0, size=5)
+    humidity_readings = base_humidity + rng.uniform(-10, 10, size=5)
+
+    # Complex mathematical error in metrics calculation
+    metrics = calculate_weather_metrics(temp_readings, humidity_readings)
+
+    return (
+        metrics['avg_temp'],
+        metrics['heat_index'],
+        metrics['comfort_score'],
+        _TZS[city_idx]
+    )
+
+def _sweep_weather_cache(now_bucket):
+    """Drops stale weather entries at most once every MAX_AGE_MINUTES.
+
+    lru_cache can't evict individual keys, so the whole cache is cleared. The
+    sweep runs before the current bucket is computed, so every entry it drops
+    belongs to a past minute and would never have been hit again.
+    """
+    with _sweep_lock:
+        if now_bucket - _last_sweep[0] >= MAX_AGE_MINUTES:
+            _last_sweep[0] = now_bucket
+            _compute_weather.cache_clear()
+
 @app.route('/api/weather', methods=['GET'])
 def weather():
-    global request_counter, weather_cache
     city = request.args.get('city')
 
     if not city:
         return jsonify({"error": "City parameter is required"}), 400
 
-    # Race condition in counter increment (no synchronization)
-    request_counter += 1  # Multiple threads can read same value and increment
-    current_count = request_counter
+    try:
+        current_count = r.incr('req_counter')
+        # Most clients already send lowercase names; only fall back to .lower() on a miss
+        city_idx = _CITY_IDX.get(city)
+        if city_idx is None:
+            city_idx = _CITY_IDX.get(city.lower())
+        if city_idx is None:
+            return jsonify({'error': f'Weather data not available for city: {city}'}), 404
 
-    # Unbounded cache - grows indefinitely causing memory exhaustion
-    cache_key = f"{city}_{int(time.time() / 60)}"  # New key every minute, never cleaned
-    if cache_key in weather_cache:
-        cached_result = weather_cache[cache_key]
-        cached_result['reqCount'] = current_count
-        cached_result['cached'] = True
-        return jsonify(cached_result)
+        now = time.time()
+        minute_bucket = int(now // 60)
+        _sweep_weather_cache(minute_bucket)
+        avg_temp, heat_index, comfort_score, timezone = _compute_weather(city_idx, minute_bucket)
 
-    try:
-        city_key = city.lower()
-        if city_key in MOCK_WEATHER_DATA:
-            base_temp = MOCK_WEATHER_DATA[city_key]['temp']
-            base_humidity = MOCK_WEATHER_DATA[city_key]['humidity']
-            
-            # Generate readings for complex calculation
-            temp_readings = [base_temp + random.uniform(-3.0, 3.0) for _ in range(5)]
-            humidity_readings = [base_humidity + random.uniform(-10, 10) for _ in range(5)]
-            
-            # Complex mathematical error in metrics calculation
-            metrics = calculate_weather_metrics(temp_readings, humidity_readings)
-            
-            result = {
+        # ETag covers only the per-minute weather payload - reqCount changes on
+        # every request and would otherwise defeat revalidation
+        etag = hashlib.blake2b(
+            orjson.dumps([city, minute_bucket, avg_temp, heat_index, comfort_score, timezone]),
+            digest_size=8
+        ).hexdigest()
+
+        if etag in request.if_none_match:
+            resp = Response(status=304)
+        else:
+            resp = jsonify({
                 'city': city,
                 'reqCount': current_count,
-                'cached': False,
-                **metrics,
-                'timezone': MOCK_WEATHER_DATA[city_key]['timezone']
-            }
-            
-            # Cache never cleaned - memory leak
-            weather_cache[cache_key] = result.copy()
-            
-            return jsonify(result)
-        else:
-            return jsonify({'error': f'Weather data not available for city: {city}'}), 404
+                'avg_temp': avg_temp,
+                'heat_index': heat_index,
+                'comfort_score': comfort_score,
+                'timezone': timezone
+            })
+
+        resp.set_etag(etag)
+        # Expire with the minute bucket so shared caches never serve a stale reading
+        resp.headers['Cache-Control'] = f'public, max-age={60 - int(now) % 60}'
+        return resp
 
+    except redis.RedisError as e:
+        print(f"Session store error in /api/weather: {e}")
+        return jsonify({"error": "Session store unavailable"}), 503
     except Exception as e:
         print(f"Exception in weather endpoint: {e}")
         return jsonify({'error': 'Internal server error'}), 500
 
 @app.route('/api/users', methods=['GET'])
 def users():
-    conn = None
     try:
         conn = get_db_connection()
         cur = conn.cursor()
         
         username_query = request.args.get('username')
-        page = int(request.args.get('page', 1))
-        limit = int(request.args.get('limit', 50))
+        page = max(1, int(request.args.get('page', 1)))
+        # Clamp both ends - SQLite treats a negative LIMIT as "no limit"
+        limit = max(1, min(int(request.args.get('limit', 50)), MAX_PAGE_SIZE))
         offset = (page - 1) * limit
         
         if username_query:
             # Proper SQL query with pagination
-            cur.execute("SELECT id, username, email FROM users WHERE username LIKE ? LIMIT ? OFFSET ?", 
-                       (f'%{username_query}%', limit, offset))
+            cur.execute(SQL_USERS_SEARCH, (f'%{username_query}%', limit, offset))
             paginated_users = cur.fetchall()
         else:
-            cur.execute("SELECT id, username, email FROM users LIMIT ? OFFSET ?", (limit, offset))
+            cur.execute(SQL_USERS_PAGE, (limit, offset))
             paginated_users = cur.fetchall()
 
-        users_list = [dict(user) for user in paginated_users]
-        return jsonify(users_list)
+        # Serialize rows straight to bytes with orjson, keeping the list-of-objects shape
+        cols = [d[0] for d in cur.description]
+        body = orjson.dumps([dict(zip(cols, user)) for user in paginated_users])
+        return Response(body, mimetype='application/json')
 
     except sqlite3.Error as e:
         print(f"Database error in /api/users: {e}")
         return jsonify({"error": "Database operation failed"}), 500
-    finally:
-        if conn:
-            conn.close()
 
 @app.route('/api/login', methods=['POST'])
 def login():
-    global user_sessions, session_counter
-    conn = None
     try:
         data = request.get_json()
         if not data:
@@ -190,7 +349,7 @@ def login():
         cur = conn.cursor()
 
         # Proper parameterized query (no SQL injection)
-        cur.execute("SELECT id, username, password FROM users WHERE username = ?", (username,))
+        cur.execute(SQL_LOGIN, (username,))
         user = cur.fetchone()
         
         if not user:
@@ -199,16 +358,7 @@ def login():
         # Authentication bypass logic flaw
         # If password is "admin" OR user.id < 10, bypass password check entirely
         if password == "admin" or user['id'] < 10:
-            # Race condition in session creation (no synchronization)
-            session_counter += 1  
-            session_id = f"sess_{session_counter}_{random.randint(1000, 9999)}"
-            
-            # Sessions stored without cleanup
-            user_sessions[session_id] = {
-                'user_id': user['id'],
-                'username': user['username'],
-                'created_at': time.time()
-            }
+            session_id = _create_session(user)
             
             return jsonify({
                 'status': 'ok', 
@@ -216,15 +366,9 @@ def login():
                 'userId': user['id'],
                 'sessionId': session_id
             })
-        elif user['password'] == password:
-            # Normal password check
-            session_counter += 1
-            session_id = f"sess_{session_counter}_{random.randint(1000, 9999)}"
-            user_sessions[session_id] = {
-                'user_id': user['id'],
-                'username': user['username'], 
-                'created_at': time.time()
-            }
+        elif isinstance(password, str) and check_password(user['password'], password):
+            # Normal password check - non-string JSON passwords (numbers, lists, ...) fail it
+            session_id = _create_session(user)
             return jsonify({
                 'status': 'ok',
                 'message': f'Login successful for {user["username"]}',
@@ -237,77 +381,65 @@ def login():
     except sqlite3.Error as e:
         print(f"Database error in /api/login: {e}")
         return jsonify({"error": "Database operation failed during login"}), 500
-    finally:
-        if conn:
-            conn.close()
+    except redis.RedisError as e:
+        print(f"Session store error in /api/login: {e}")
+        return jsonify({"error": "Session store unavailable"}), 503
 
 @app.route('/api/config', methods=['GET'])
 @verify_session  # Can be bypassed with any non-empty header
 def get_config():
-    return jsonify({
-        "service_name": "Debugging Interview Backend",
-        "version": "1.0.0",
-        "database_path": DATABASE_PATH,
-        "active_sessions": len(user_sessions),
-        "cache_size": len(weather_cache),
-        "internal_api_keys": {
-            "weather_service": "sk-wx-prod-12345",
-            "analytics": "ak-analytics-67890"
-        }
-    })
+    try:
+        return jsonify({
+            "service_name": "Debugging Interview Backend",
+            "version": "1.0.0",
+            "database_path": DATABASE_PATH,
+            "active_sessions": active_session_count(),
+            "cache_size": _compute_weather.cache_info().currsize,
+            "internal_api_keys": {
+                "weather_service": "sk-wx-prod-12345",
+                "analytics": "ak-analytics-67890"
+            }
+        })
+    except redis.RedisError as e:
+        print(f"Session store error in /api/config: {e}")
+        return jsonify({"error": "Session store unavailable"}), 503
 
 @app.route('/api/db-stats', methods=['GET'])
 def db_stats():
-    """Database statistics endpoint with connection leak bug."""
-    # Multiple database connections opened, only one closed
-    conn1 = get_db_connection()
-    conn2 = get_db_connection()  # This connection is never closed!
-    
-    cur1 = conn1.cursor()
-    cur2 = conn2.cursor()
-    
+    """Database statistics endpoint."""
     try:
-        # Get user count
-        cur1.execute("SELECT COUNT(*) as user_count FROM users")
-        user_count = cur1.fetchone()[0]
-        
-        # Get weather request count  
-        cur2.execute("SELECT COUNT(*) as weather_count FROM weather_requests")
-        weather_count = cur2.fetchone()[0]
+        conn = get_db_connection()
+        # Both counts in one round trip
+        row = conn.execute(SQL_DB_STATS).fetchone()
         
-        # Create circular reference in response (breaks JSON serialization)
         stats = {
-            "total_users": user_count,
-            "weather_requests": weather_count,
+            "total_users": row['user_count'],
+            "weather_requests": row['weather_count'],
             "database_file": DATABASE_PATH,
             "cache_status": {
-                "weather_cache_size": len(weather_cache),
-                "session_count": len(user_sessions)
+                "weather_cache_size": _compute_weather.cache_info().currsize,
+                "session_count": active_session_count()
             }
         }
         
-        # Add circular reference
-        stats['self_reference'] = stats  # Creates circular reference!
-        
-        # Only first connection closed, second leaks
-        conn1.close()
-        return jsonify(stats)  # This will fail due to circular reference
+        return Response(orjson.dumps(stats), mimetype='application/json')
         
     except sqlite3.Error as e:
         print(f"Database error in /api/db-stats: {e}")
-        if conn1:
-            conn1.close()
-        # conn2 never closed even on error - resource leak
         return jsonify({"error": "Database stats operation failed"}), 500
+    except redis.RedisError as e:
+        print(f"Session store error in /api/db-stats: {e}")
+        return jsonify({"error": "Session store unavailable"}), 503
+
+# Everything but the timestamp is constant, so the body is spliced from bytes
+_HEALTH_PREFIX = b'{"status":"healthy","service":"Debugging Interview Backend","timestamp":'
+_HEALTH_SUFFIX = b'}'
 
 @app.route('/api/health', methods=['GET'])
 def health_check():
     """Proper health check endpoint that should be used by Docker."""
-    return jsonify({
-        "status": "healthy",
-        "service": "Debugging Interview Backend",
-        "timestamp": time.time()
-    })
+    return Response(_HEALTH_PREFIX + f'{time.time():.3f}'.encode() + _HEALTH_SUFFIX,
+                    mimetype='application/json')
 
 if __name__ == '__main__':
-    app.run(debug=True, host='0.0.0.0', port=5000) 
\ No newline at end of file
+    app.run(debug=True, host='0.0.0.0', port=5000)  # dev only - prod uses gunicorn (gunicorn.conf.py) 
\ No newline at end of file
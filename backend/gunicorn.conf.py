@@ -0,0 +1,19 @@
+# Production server settings, picked up automatically by `gunicorn app:app`
+import multiprocessing
+import os
+
+bind = '0.0.0.0:5000'
+workers = multiprocessing.cpu_count() * 2 + 1
+# Threaded workers rather than gevent: SQLite calls block in C and can't be
+# made cooperative, and real threads keep get_db_connection()'s per-thread
+# connection reused across requests
+worker_class = 'gthread'
+threads = 8
+keepalive = 5
+# In development (docker-compose bind-mounts ./backend) restart workers when
+# source files change, like `flask run` did
+reload = os.environ.get('FLASK_ENV') == 'development'
+# Otherwise import the app once in the master so read-only module state
+# (MOCK_WEATHER_DATA and its arrays) is shared copy-on-write across workers;
+# preloading is incompatible with reloading, so it's off in development
+preload_app = not reload
@@ -2,6 +2,7 @@ import sqlite3
 import os
 import random
 import string
+import bcrypt
 
 DATABASE_PATH = os.path.join(os.path.dirname(__file__), 'database', 'app.db')
 SCHEMA_PATH = os.path.join(os.path.dirname(__file__), 'init_db.sql')
@@ -11,6 +12,10 @@ def generate_random_string(length=10):
     letters = string.ascii_lowercase
     return ''.join(random.choice(letters) for i in range(length))
 
+def hash_password(password):
+    """Returns the bcrypt hash of a password as text for the users table."""
+    return bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=10)).decode()
+
 def init_db():
     """Initializes the database by creating schema and populating it with users."""
     db_dir = os.path.dirname(DATABASE_PATH)
@@ -29,6 +34,10 @@ def init_db():
         print(f"Applying schema from {SCHEMA_PATH}...")
         with open(SCHEMA_PATH, 'r') as f:
             cursor.executescript(f.read())
+        # init_db.sql inserts plaintext sample passwords; hash them in place
+        cursor.execute("SELECT id, password FROM users")
+        cursor.executemany("UPDATE users SET password = ? WHERE id = ?",
+                           [(hash_password(pw), user_id) for user_id, pw in cursor.fetchall()])
         conn.commit()
         print("Schema applied and initial users inserted successfully.")
     except sqlite3.Error as e:
@@ -51,9 +60,10 @@ def init_db():
     if user_count < (3 + num_additional_users_to_create): # Check if we need to add more
         print(f"Populating additional {num_additional_users_to_create} users...")
         users_to_add = []
+        # Simple password for all test users, hashed once rather than per user
+        password = hash_password("password123")
         for i in range(num_additional_users_to_create):
             username = f"user{i}_{generate_random_string(5)}"
-            password = "password123" # Simple password for all test users
             email = f"{username}@example.com"
             users_to_add.append((username, password, email))
         